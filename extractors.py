@@ -0,0 +1,47 @@
+'''CPU-bound text extraction run in the process pool.
+
+Kept out of main.py so pickled references resolve to this module, which is importable
+in the workers and stays the same object across Streamlit reruns.
+'''
+import re
+
+# runs of whitespace and control characters left over from PDF/HTML extraction
+_WHITESPACE_RE = re.compile(r'[\s\x00-\x1f\x7f-\x9f]+')
+
+# extracted text is cut to TEXT_LIMIT chars once, at extraction, so later pages are never used
+TEXT_LIMIT = 200_000
+
+def clean_text(text):
+    '''Collapse whitespace and drop control characters, which cost tokens but carry no meaning'''
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+def count_pdf_pages(content):
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(content)
+    try:
+        return len(pdf)
+    finally:
+        pdf.close()
+
+def extract_pdf_pages(content, page_indices):
+    import pypdfium2 as pdfium
+    pdf = pdfium.PdfDocument(content)
+    try:
+        parts = []
+        for i in page_indices:
+            page_text = pdf[i].get_textpage().get_text_range()
+            if page_text:
+                parts.append(page_text)
+        return parts
+    finally:
+        pdf.close()
+
+def extract_html_text(html):
+    from selectolax.lexbor import LexborHTMLParser
+    # only the text is needed, so skip building a full DOM
+    tree = LexborHTMLParser(html)
+    # page chrome and scripts would only add noise tokens to the prompt
+    for node in tree.css('script, style, nav, footer'):
+        node.decompose()
+    text = tree.body.text(separator="\n") if tree.body else tree.text(separator="\n")
+    return clean_text(text)[:TEXT_LIMIT]
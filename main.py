@@ -1,38 +1,170 @@
 import streamlit as st
 import asyncio
+import concurrent.futures
+import functools
+import hashlib
+import importlib.machinery
+import io
+import logging
+import multiprocessing
+import os
+import threading
+import weakref
+import diskcache
+import tiktoken
 import aiohttp
-import feedparser
+from dataclasses import dataclass, field
+from lxml import etree
 import re
 import urllib.parse
-from bs4 import BeautifulSoup
-import io
-import PyPDF2
-from agentjo import strict_json_async  # Assuming agentjo is pip installable
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_JUSTIFY, TA_LEFT, TA_CENTER
-from reportlab.lib import colors
-
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_random_exponential
+import extractors
+from extractors import clean_text
+# pypdfium2, selectolax, agentjo, openai and reportlab are imported
+# where they are used, so the first page load doesn't wait on them
+
+
+logger = logging.getLogger(__name__)
+
+_CITE_KEY_RE = re.compile(r'@\w+\s*\{\s*([^,]+),')
+_ARXIV_VERSION_RE = re.compile(r'v\d+$')
+_CITATION_LINK_RE = re.compile(r'\[\[(.*?)\]\]\((.*?)\)')
+# the bibtex fields the report needs for in-line links and APA citations, one per line in arXiv's bibtex
+_BIBTEX_FIELDS_RE = re.compile(r'^\s*(author|title|year|url)\s*=\s*[{"]?(.*?)[}"]?\s*,?\s*$', re.M | re.I)
+
+_ATOM_NS = '{http://www.w3.org/2005/Atom}'
+# the feed is remote input, so entities and network lookups stay off
+_FEED_PARSER = etree.XMLParser(resolve_entities=False, no_network=True)
+
+_PDF_MAX_PAGES = 30
+# each worker is sent the whole PDF, so it should get at least this many pages to extract
+_PDF_PAGES_PER_WORKER = 8
+# larger PDFs are abandoned mid-download in favour of the HTML page or abstract
+_PDF_MAX_BYTES = 10 * 1024 * 1024
+# returned instead of text for PDFs over _PDF_MAX_BYTES
+_PDF_TOO_LARGE = "PDF skipped: larger than the download limit"
+
+# relevance prompts are cut by tokens, which tracks latency, cost and context limits better than chars
+_PROMPT_TOKEN_LIMIT = 60_000
+
+# bound how many documents are held in memory and decoded at once
+_PDF_CONCURRENCY = 4
+_HTML_CONCURRENCY = 16
+# arXiv answers bursts with 503s, so GETs and completions are throttled below the rate limits
+_HTTP_CONCURRENCY = 5
+_LLM_CONCURRENCY = 8
+# arXiv's HTML rendition is tried first and abandoned quickly for the PDF
+_ARXIV_HTML_TIMEOUT = aiohttp.ClientTimeout(total=3)
+
+# per-passage share of the batched relevance prompt
+_BATCH_TEXT_LIMIT = 20000
+# papers are sent to the filter in groups of this size as they finish fetching
+_FILTER_BATCH_SIZE = 4
+# once this many papers pass the filter, papers still fetching are dropped
+_RELEVANT_ENOUGH = 5
+
+# per-source share of the report prompt when papers go straight to report writing
+_SOURCE_TEXT_LIMIT = 15000
+
+# fetched responses, extracted text and search results are reused from disk for a day
+_CACHE_DIR = ".cache"
+_CACHE_TTL = 24 * 3600
+# a given arXiv version never changes, so its bibtex and extracted text are kept much longer
+_ARXIV_CACHE_TTL = 30 * 24 * 3600
+
+# extracted texts remembered per browser session, on top of the disk cache
+_URL_MEMO_SIZE = 256
 
 # --- Utility Functions ---
-async def llm(system_prompt: str, user_prompt: str) -> str:
+async def async_get_openai_client():
+    '''AsyncOpenAI client kept with the session's resources, so its connection pool is reused across calls and reruns'''
+    api_key = st.session_state.openai_api_key
+    clients = get_session_resources().clients
+    client = clients.get("openai")
+    if client is None or client.api_key != api_key:
+        import httpx
+        from openai import AsyncOpenAI
+        # fail fast on connect, but keep the default read timeout: reasoning models send nothing while they think
+        old_client, client = client, AsyncOpenAI(api_key=api_key, max_retries=2, timeout=httpx.Timeout(600, connect=10))
+        clients["openai"] = client
+        if old_client is not None:
+            # the key changed, so release the old client's connections now
+            await old_client.close()
+    return client
+
+async def llm(system_prompt: str, user_prompt: str, model: str = None, temperature: float = None) -> str:
     ''' Here, we use OpenAI for illustration, you can change it to your own LLM '''
-    # ensure your LLM imports are all within this function
-    from openai import AsyncOpenAI
-
     # define your own LLM here
-    client = AsyncOpenAI(api_key=st.session_state.openai_api_key)
-    response = await client.chat.completions.create(
-        model=st.session_state.llm_model_name,
-        # temperature = 0,
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_prompt}
-        ]
-    )
+    client = await async_get_openai_client()
+    # reasoning models reject temperature, so only send it when asked for
+    extra_args = {} if temperature is None else {"temperature": temperature}
+    async with get_session_resources().llm_sem:
+        response = await client.chat.completions.create(
+            model=model or st.session_state.llm_model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            **extra_args
+        )
     return response.choices[0].message.content
 
+async def llm_stream(system_prompt: str, user_prompt: str, model: str = None):
+    ''' Streaming variant of llm() that yields the response text as it is generated '''
+    client = await async_get_openai_client()
+    # the slot is held until the stream ends, since the request is open the whole time
+    async with get_session_resources().llm_sem:
+        stream = await client.chat.completions.create(
+            model=model or st.session_state.llm_model_name,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt}
+            ],
+            stream=True
+        )
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+
+def llm_cache_scope(system_prompt: str, model: str, temperature: float) -> str:
+    return hashlib.sha256(f"{model}\0{temperature}\0{system_prompt}".encode()).hexdigest()
+
+def llm_exact_cache_key(scope: str, user_prompt: str):
+    return ("llm", scope, hashlib.sha256(user_prompt.encode()).hexdigest())
+
+async def cached_llm(system_prompt: str, user_prompt: str, model: str = None, temperature: float = None) -> str:
+    ''' llm() behind an exact-match cache keyed on the model, temperature and both prompts '''
+    cache = get_disk_cache()
+    model = model or st.session_state.llm_model_name
+    exact_key = llm_exact_cache_key(llm_cache_scope(system_prompt, model, temperature), user_prompt)
+    response = cache.get(exact_key)
+    if response is not None:
+        return response
+
+    response = await llm(system_prompt, user_prompt, model=model, temperature=temperature)
+    cache.set(exact_key, response, expire=_CACHE_TTL)
+    return response
+
+async def cached_llm_stream(system_prompt: str, user_prompt: str, model: str = None):
+    ''' llm_stream() behind the same exact-match cache as cached_llm; a hit is yielded in one piece '''
+    cache = get_disk_cache()
+    model = model or st.session_state.llm_model_name
+    exact_key = llm_exact_cache_key(llm_cache_scope(system_prompt, model, None), user_prompt)
+    response = cache.get(exact_key)
+    if response is not None:
+        yield response
+        return
+
+    parts = []
+    async for delta in llm_stream(system_prompt, user_prompt, model=model):
+        parts.append(delta)
+        yield delta
+    cache.set(exact_key, "".join(parts), expire=_CACHE_TTL)
+
+async def relevance_llm(system_prompt: str, user_prompt: str) -> str:
+    ''' Cheaper, deterministic model for the per-paper relevance filter; the reasoning model is kept for the report '''
+    return await cached_llm(system_prompt, user_prompt, model=st.session_state.relevance_model_name, temperature=0)
+
 def format_arxiv_query(query):
     words = query.strip().split()
     if not words:
@@ -40,157 +172,468 @@ def format_arxiv_query(query):
     formatted_query = " AND ".join(f"all:{word}" for word in words)
     return urllib.parse.quote(formatted_query)
 
+def slim_bibtex(bibtex_text):
+    '''Keep only author, title, year and url from a bibtex entry'''
+    return {name.lower(): value for name, value in _BIBTEX_FIELDS_RE.findall(bibtex_text)}
+
 def extract_citation_key(bibtex_text):
-    pattern = r'@\w+\s*\{\s*([^,]+),'
-    match = re.search(pattern, bibtex_text)
+    match = _CITE_KEY_RE.search(bibtex_text)
     if match:
         return match.group(1).strip()
     return None
 
-async def async_fetch_feed(query_url, session):
-    async with session.get(query_url) as response:
+# Streamlit runs this file as a fresh spec-less __main__ module, so spawned pool workers would
+# re-run all of its imports; a spec named "__main__" tells multiprocessing there is nothing to
+# re-import, and workers only load extractors
+__spec__ = importlib.machinery.ModuleSpec("__main__", None)
+
+@st.cache_resource
+def get_process_pool():
+    '''Process pool for CPU-bound text extraction, created on first use and shared across reruns'''
+    # spawn rather than fork the threaded Streamlit server; submit only functions from extractors,
+    # since this script's functions are new objects on every rerun and no longer pickle
+    return concurrent.futures.ProcessPoolExecutor(max_workers=os.cpu_count(),
+                                                  mp_context=multiprocessing.get_context("spawn"))
+
+async def async_run_in_pool(func, *args):
+    '''Run func in the process pool, replacing the pool once if a crashed worker has broken it'''
+    loop = asyncio.get_running_loop()
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except concurrent.futures.process.BrokenProcessPool:
+        # the cached pool stays broken for every later call, so drop it unless another caller already has
+        if get_process_pool() is pool:
+            get_process_pool.clear()
+        return await loop.run_in_executor(get_process_pool(), func, *args)
+
+@st.cache_resource
+def get_token_encoding():
+    '''Tokenizer shared by the gpt-4o and o-series models, loaded once'''
+    return tiktoken.get_encoding("o200k_base")
+
+def trim_to_tokens(text, max_tokens=_PROMPT_TOKEN_LIMIT):
+    encoding = get_token_encoding()
+    tokens = encoding.encode(clean_text(text), disallowed_special=())
+    return encoding.decode(tokens[:max_tokens])
+
+@st.cache_resource
+def get_disk_cache():
+    '''On-disk cache shared across reruns, so repeat runs skip network and parse work'''
+    return diskcache.Cache(_CACHE_DIR)
+
+def is_retrieval_error(text):
+    '''Fetch helpers report transient failures as text, so they can be kept out of caches'''
+    return text.startswith("Error retrieving")
+
+def cache_on_disk(key_fn, expire=_ARXIV_CACHE_TTL):
+    '''Persist a coroutine's result in the disk cache under key_fn(*args); "Error retrieving ..." results are not kept'''
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args):
+            cache = get_disk_cache()
+            key = key_fn(*args)
+            result = cache.get(key)
+            if result is None:
+                result = await func(*args)
+                if not is_retrieval_error(result):
+                    cache.set(key, result, expire=expire)
+            return result
+        return wrapper
+    return decorator
+
+class SharedTask:
+    '''One task awaited by any number of callers, kept in registry[key] while it is wanted'''
+    def __init__(self, registry, key, coro, forget=lambda task: True):
+        self.registry = registry
+        self.key = key
+        self.task = asyncio.ensure_future(coro)
+        self.waiters = 0
+        registry[key] = self
+        # forget(task) decides whether a finished task leaves the registry
+        self.task.add_done_callback(lambda task: forget(task) and self.unregister())
+
+    def unregister(self):
+        if self.registry.get(self.key) is self:
+            del self.registry[self.key]
+
+    async def wait(self):
+        self.waiters += 1
+        try:
+            # shield so one caller being cancelled doesn't cancel the work for the others
+            return await asyncio.shield(self.task)
+        finally:
+            self.waiters -= 1
+            # every caller gave up, so stop the work instead of finishing it for nobody
+            if not self.waiters and not self.task.done():
+                self.unregister()
+                self.task.cancel()
+
+class ResponseTooLarge(ValueError):
+    pass
+
+def is_rate_limited(exception):
+    return isinstance(exception, aiohttp.ClientResponseError) and exception.status in (429, 503)
+
+async def async_get_bytes(url, session, max_bytes=None, timeout=None):
+    '''GET url within the shared HTTP limit; raises ResponseTooLarge past max_bytes'''
+    # only override the session's timeout when asked, since timeout=None would disable it
+    request_kwargs = {"timeout": timeout} if timeout else {}
+    # the slot paces requests until the headers arrive; bodies (up to a 10 MB PDF) are read
+    # after releasing it, so the HTTP limit never caps how many PDFs download at once
+    async with get_session_resources().http_sem:
+        response = await session.get(url, **request_kwargs)
+    async with response:
         response.raise_for_status()
-        return await response.text()
+        if max_bytes is None:
+            return await response.read()
+        if response.content_length and response.content_length > max_bytes:
+            raise ResponseTooLarge(f"response is larger than {max_bytes} bytes")
+        # stream so an oversized body is abandoned without downloading the rest
+        buffer = bytearray()
+        async for chunk in response.content.iter_chunked(65536):
+            buffer += chunk
+            if len(buffer) > max_bytes:
+                raise ResponseTooLarge(f"response is larger than {max_bytes} bytes")
+        return bytes(buffer)
+
+# retries 429/503 responses, backing off outside the semaphore so a throttled request doesn't hold a slot while it sleeps
+async_get_bytes_with_retry = retry(retry=retry_if_exception(is_rate_limited), wait=wait_random_exponential(1, 30),
+                                   stop=stop_after_attempt(5), reraise=True)(async_get_bytes)
+
+# GETs currently on the wire, so concurrent requests for the same url share one download
+_INFLIGHT = {}
+
+async def async_fetch_once(url, session, max_bytes=None, timeout=None, retry_rate_limited=True):
+    '''Join an identical GET that is already in flight instead of issuing another'''
+    shared = _INFLIGHT.get(url)
+    if shared is None:
+        get_bytes = async_get_bytes_with_retry if retry_rate_limited else async_get_bytes
+        shared = SharedTask(_INFLIGHT, url, get_bytes(url, session, max_bytes=max_bytes, timeout=timeout))
+    return await shared.wait()
+
+async def async_fetch_bytes(url, session, max_bytes=None, cache_response=True, timeout=None, retry_rate_limited=True):
+    '''GET url, serving repeat requests from the disk cache; raises ResponseTooLarge past max_bytes'''
+    cache = get_disk_cache()
+    content = cache.get(url) if cache_response else None
+    if content is None:
+        content = await async_fetch_once(url, session, max_bytes=max_bytes, timeout=timeout,
+                                         retry_rate_limited=retry_rate_limited)
+        if cache_response:
+            cache.set(url, content, expire=_CACHE_TTL)
+    return content
+
+async def async_fetch_text(url, session, cache_response=True, timeout=None, retry_rate_limited=True):
+    content = await async_fetch_bytes(url, session, cache_response=cache_response, timeout=timeout,
+                                      retry_rate_limited=retry_rate_limited)
+    return content.decode("utf-8", errors="replace")
 
+async def async_fetch_feed(query_url, session):
+    # raw bytes, since lxml reads the encoding from the XML declaration
+    return await async_fetch_bytes(query_url, session)
+
+@dataclass
+class ArxivLink:
+    href: str
+    type: str = None
+    rel: str = 'alternate'
+
+@dataclass
+class ArxivEntry:
+    id: str
+    summary: str = ""
+    links: list = field(default_factory=list)
+
+def parse_arxiv_feed(xml_data):
+    '''Parse the fixed-schema arXiv Atom feed into ArxivEntry objects'''
+    root = etree.fromstring(xml_data, _FEED_PARSER)
+    entries = []
+    # entries and their links are direct children, so skip walking the whole subtree
+    for entry in root.findall(f'{_ATOM_NS}entry'):
+        links = [ArxivLink(href=link.get('href'), type=link.get('type'), rel=link.get('rel', 'alternate'))
+                 for link in entry.findall(f'{_ATOM_NS}link')]
+        entries.append(ArxivEntry(id=entry.findtext(f'{_ATOM_NS}id', default=""),
+                                  summary=entry.findtext(f'{_ATOM_NS}summary', default=""),
+                                  links=links))
+    return entries
+
+@cache_on_disk(lambda entry, session: ("bibtex", entry.id.rpartition('/abs/')[2]))
 async def async_get_bibtex_entry(entry, session):
     try:
         abs_url = entry.id
-        parts = abs_url.split('/abs/')
-        if len(parts) < 2:
+        _, sep, arxiv_id_with_version = abs_url.rpartition('/abs/')
+        if not sep:
             return "No valid arXiv id found in entry.id"
-        arxiv_id_with_version = parts[1]
-        arxiv_id = re.split("v", arxiv_id_with_version)[0]
+        arxiv_id = _ARXIV_VERSION_RE.sub('', arxiv_id_with_version)
         bibtex_url = f"https://arxiv.org/bibtex/{arxiv_id}"
-        async with session.get(bibtex_url) as response:
-            response.raise_for_status()
-            return await response.text()
+        return await async_fetch_text(bibtex_url, session, cache_response=False)
     except Exception as e:
         return f"Error retrieving BibTeX: {str(e)}"
 
+async def async_extract_pdf_pages(content, pdf_url):
+    '''Extract PDF text with its pages split across the process pool'''
+    # counting only reads the page tree, so it is done here rather than shipping the PDF to a worker for it
+    total_pages = extractors.count_pdf_pages(content)
+    num_pages = min(total_pages, _PDF_MAX_PAGES)
+    if total_pages > num_pages:
+        logger.info("Skipping pages %d-%d of %s", num_pages + 1, total_pages, pdf_url)
+    # one contiguous run of pages per worker (ceil division), but never so few pages
+    # that pickling the whole PDF to the worker costs more than the extraction it saves
+    chunk_size = max(_PDF_PAGES_PER_WORKER, -(-num_pages // os.cpu_count()))
+    chunks = [range(start, min(start + chunk_size, num_pages)) for start in range(0, num_pages, chunk_size)]
+    chunk_parts = await asyncio.gather(*[async_run_in_pool(extractors.extract_pdf_pages, content, chunk) for chunk in chunks])
+    parts = [part for chunk in chunk_parts for part in chunk]
+    return "\n".join(parts)[:extractors.TEXT_LIMIT] if parts else "No text could be extracted from the PDF."
+
+def is_failed_task(task):
+    return task.cancelled() or task.exception() is not None or is_retrieval_error(task.result())
+
+def memoize_by_url(func):
+    '''Share one in-flight or successful extraction per URL across callers for the rest of the browser session'''
+    @functools.wraps(func)
+    async def wrapper(url, session):
+        tasks = st.session_state.setdefault(f"{func.__name__}_tasks", {})
+        shared = tasks.get(url)
+        if shared is None:
+            if len(tasks) >= _URL_MEMO_SIZE:
+                tasks.pop(next(iter(tasks)))
+            # failures are forgotten, so the next click retries the URL
+            shared = SharedTask(tasks, url, func(url, session), forget=is_failed_task)
+        return await shared.wait()
+    return wrapper
+
+@memoize_by_url
+@cache_on_disk(lambda pdf_url, session: ("pdf_text", pdf_url.rpartition('/pdf/')[2]))
 async def async_extract_pdf_text(pdf_url, session):
     try:
-        async with session.get(pdf_url) as response:
-            response.raise_for_status()
-            content = await response.read()
-
-            def extract_text(content):
-                with io.BytesIO(content) as f:
-                    reader = PyPDF2.PdfReader(f)
-                    text = ""
-                    for page in reader.pages:
-                        page_text = page.extract_text()
-                        if page_text:
-                            text += page_text + "\n"
-                    return text if text else "No text could be extracted from the PDF."
-
-            return await asyncio.to_thread(extract_text, content)
+        # read inside the semaphore so raw PDF bytes aren't held while waiting for a slot
+        async with get_session_resources().pdf_sem:
+            # only the extracted text is cached, by arXiv id, so the PDF bytes never hit the disk
+            content = await async_fetch_bytes(pdf_url, session, max_bytes=_PDF_MAX_BYTES, cache_response=False)
+            return await async_extract_pdf_pages(content, pdf_url)
+    except ResponseTooLarge:
+        # a deliberate skip, not a failure, so it is cached like any other result
+        return _PDF_TOO_LARGE
     except Exception as e:
         return f"Error retrieving PDF text: {str(e)}"
 
+async def async_parse_html(html):
+    '''Parse in a worker process so concurrent entries don't serialize on the GIL'''
+    return await async_run_in_pool(extractors.extract_html_text, html)
+
+@memoize_by_url
 async def async_extract_html_text(html_url, session):
     try:
-        async with session.get(html_url) as response:
-            response.raise_for_status()
-            html = await response.text()
-            soup = BeautifulSoup(html, 'html.parser')
-            text = soup.get_text(separator="\n")
-            cleaned_text = re.sub(r'\n+', '\n', text).strip()
-            return cleaned_text
+        async with get_session_resources().html_sem:
+            html = await async_fetch_text(html_url, session)
+            return await async_parse_html(html)
     except Exception as e:
         return f"Error retrieving HTML text: {str(e)}"
 
-async def async_retrieve_important(user_output: str, metadata_text: str):
-    '''Retrieve what is important to user_output from metadata_text'''
-    res = await strict_json_async(f'''From the Text, extract useful information for query: ```{user_output}```
+@memoize_by_url
+@cache_on_disk(lambda html_url, session: ("arxiv_html_text", html_url.rpartition('/html/')[2]))
+async def async_extract_arxiv_html_text(html_url, session):
+    '''Full text from arXiv's HTML rendition, which only exists for newer papers'''
+    try:
+        async with get_session_resources().html_sem:
+            # a probe: on a throttled or slow answer, fall back to the PDF instead of backing off for up to minutes
+            html = await async_fetch_text(html_url, session, cache_response=False, timeout=_ARXIV_HTML_TIMEOUT,
+                                          retry_rate_limited=False)
+            return await async_parse_html(html)
+    except Exception as e:
+        return f"Error retrieving HTML text: {str(e)}"
+
+_RETRIEVE_IMPORTANT_PROMPT = '''From the Text, extract useful information for query: ```{user_output}```
 You must put all details so that another person can understand without referencing the Text.
 You must output quantitative results and detailed descriptions whenever applicable.
-You must output 'NA' if Text is not useful for query or if you are unsure''',
-                             "Text: " + metadata_text[:200000],
+You must output 'NA' if Text is not useful for query or if you are unsure'''
+_FILTERED_INFORMATION_FORMAT = "Be detailed, only those directly related to query ```{user_output}```, 'NA' if not useful, type: str"
+
+async def async_retrieve_important(user_output: str, metadata_text: str):
+    '''Retrieve what is important to user_output from metadata_text'''
+    # tokenizing 200 000 chars is CPU-bound, so keep it off the event loop
+    metadata_text = await asyncio.to_thread(trim_to_tokens, metadata_text)
+    from agentjo import strict_json_async
+    res = await strict_json_async(_RETRIEVE_IMPORTANT_PROMPT.format(user_output=user_output),
+                             "Text: " + metadata_text,
                              output_format = {
                                  "Text Relevant for query": "type: bool",
                                  "Important Information": "type: str",
-                                 "Filtered Detailed Important Information": f"Be detailed, only those directly related to query ```{user_output}```, 'NA' if not useful, type: str"},
-                             llm = llm)
+                                 "Filtered Detailed Important Information": _FILTERED_INFORMATION_FORMAT.format(user_output=user_output)},
+                             llm = relevance_llm)
     if res["Text Relevant for query"]:
         return res["Filtered Detailed Important Information"]
     else:
         return 'NA'
 
-async def search_arxiv(query, user_output, session):
+async def async_retrieve_important_batch(user_output: str, metadata_texts: list[str]):
+    '''Retrieve what is important to user_output from every text in metadata_texts with one LLM call'''
+    if not metadata_texts:
+        return []
+    passages = [text[:_BATCH_TEXT_LIMIT] for text in metadata_texts]
+    numbers = range(1, len(passages) + 1)
+
+    # one bool and one str key per Passage, since strict_json only converts true/false for bool fields
+    output_format = {}
+    for i in numbers:
+        output_format[f"Passage {i} Relevant for query"] = "type: bool"
+        output_format[f"Passage {i} Filtered Detailed Important Information"] = _FILTERED_INFORMATION_FORMAT.format(user_output=user_output)
+
+    from agentjo import strict_json_async
+    res = await strict_json_async(f'''From each Passage, extract useful information for query: ```{user_output}```
+You must put all details so that another person can understand without referencing the Passage.
+You must output quantitative results and detailed descriptions whenever applicable.
+You must output 'NA' if Passage is not useful for query or if you are unsure''',
+                             "\n".join(f"Passage {i}:\n{passage}" for i, passage in zip(numbers, passages)),
+                             output_format = output_format,
+                             llm = relevance_llm)
+    try:
+        return [res[f"Passage {i} Filtered Detailed Important Information"] if res[f"Passage {i} Relevant for query"] is True else 'NA'
+                for i in numbers]
+    except KeyError:
+        # strict_json gave up on the batch, so ask about each passage separately
+        return await asyncio.gather(*[async_retrieve_important(user_output, text) for text in metadata_texts])
+
+async def async_get_entry_text(entry, session):
+    '''Get the text of an arXiv entry, trying arXiv's HTML rendition, then the PDF, then the abstract page.
+
+    Returns (text, complete), where complete is False if a fetch failed and a fallback was used instead.
+    '''
+    # the HTML rendition parses far faster than the PDF, so try it first;
+    # many papers have none, so a failed probe is expected and doesn't count against complete
+    arxiv_id = entry.id.rpartition('/abs/')[2]
+    if arxiv_id:
+        text = await async_extract_arxiv_html_text(f"https://arxiv.org/html/{arxiv_id}", session)
+        if not is_retrieval_error(text):
+            return text, True
+
+    # Determine PDF and HTML URLs.
+    pdf_url = None
+    html_url = None
+    for link in entry.links:
+        if link.type == 'application/pdf':
+            pdf_url = link.href
+        elif link.rel == 'alternate':
+            html_url = link.href
+
+    complete = True
+    if pdf_url:
+        text = await async_extract_pdf_text(pdf_url, session)
+        # oversized or unreadable PDFs fall through to the HTML page or abstract
+        if text != _PDF_TOO_LARGE:
+            if not is_retrieval_error(text):
+                return text, True
+            complete = False
+    if html_url:
+        text = await async_extract_html_text(html_url, session)
+        return text, complete and not is_retrieval_error(text)
+    # If no PDF or HTML link is available, fall back to the abstract.
+    return entry.summary.strip(), complete
+
+async def async_get_source(index, entry, session):
+    '''Fetch bibtex and text for one entry without waiting on other entries'''
+    bibtex_entry, (metadata_text, text_complete) = await asyncio.gather(async_get_bibtex_entry(entry, session),
+                                                                        async_get_entry_text(entry, session))
+    return index, bibtex_entry, metadata_text, text_complete and not is_retrieval_error(bibtex_entry)
+
+async def search_arxiv(query, user_output, session, relevance_filter=False, on_source=None):
+    '''Search arXiv and build report sources, calling on_source(id, bibtex_entry, text) as each paper finishes'''
     base_url = "http://export.arxiv.org/api/query?"
     formatted_query = format_arxiv_query(query)
     query_url = f"{base_url}search_query={formatted_query}&start=0&max_results=10"
 
+    # Unchanged inputs give unchanged sources, so the whole search is served from disk
+    cache = get_disk_cache()
+    filter_inputs = (user_output, st.session_state.relevance_model_name) if relevance_filter else None
+    cache_key = ("search_arxiv", query, relevance_filter, filter_inputs)
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # Fetch the arXiv feed asynchronously.
     xml_data = await async_fetch_feed(query_url, session)
-    feed = feedparser.parse(xml_data)
-
-    # Schedule tasks for retrieving BibTeX entries and metadata concurrently.
-    bibtex_tasks = []
-    metadata_tasks = []
-    for entry in feed.entries:
-        # BibTeX task
-        bibtex_tasks.append(async_get_bibtex_entry(entry, session))
-
-        # Determine PDF and HTML URLs.
-        pdf_url = None
-        html_url = None
-        if hasattr(entry, 'links'):
-            for link in entry.links:
-                if link.get('type') == 'application/pdf':
-                    pdf_url = link.href
-                elif link.get('rel') == 'alternate':
-                    html_url = link.href
-
-        # Metadata task: try PDF first, then HTML.
-        if pdf_url:
-            metadata_tasks.append(async_extract_pdf_text(pdf_url, session))
-        elif html_url:
-            metadata_tasks.append(async_extract_html_text(html_url, session))
-        else:
-            # If no PDF or HTML link is available, return a default message.
-            metadata_tasks.append(asyncio.sleep(0, result = entry.summary.strip()))
-
-    # Await all BibTeX and metadata tasks concurrently.
-    bibtex_entries = await asyncio.gather(*bibtex_tasks)
-    metadata_texts = await asyncio.gather(*metadata_tasks)
-
-    # make bibtex_entries into dict form
-    bibtex_dict = {extract_citation_key(bibtex_entry): bibtex_entry for bibtex_entry in bibtex_entries}
-
-    # Get the important information out
-    synthesis_tasks = [async_retrieve_important(user_output, metadata_texts[i]) for i in range(len(metadata_texts))]
-    important_information = await asyncio.gather(*synthesis_tasks)
-
-    return bibtex_dict, important_information
-
-
-
-async def generate_report_markdown(bibtex_dict, important_information, user_output):
-    # Further corrected f-string syntax
-    res = await strict_json_async(f'''Generate a research report in markdown format for the query: ```{user_output}```
+    entries = parse_arxiv_feed(xml_data)
+
+    # Start every paper at once and report each as soon as it is fetched
+    pending = {asyncio.create_task(async_get_source(i, entry, session)) for i, entry in enumerate(entries)}
+    bibtex_entries = [None] * len(entries)
+    metadata_texts = [None] * len(entries)
+    filter_batches = {}
+    ready = []
+    relevant_count = 0
+    # results with a failed fetch are returned but not cached, so the next run retries them
+    complete = True
+    while pending or filter_batches:
+        done, _ = await asyncio.wait(pending | set(filter_batches), return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task in filter_batches:
+                for i, important_information in zip(filter_batches.pop(task), task.result()):
+                    metadata_texts[i] = important_information
+                    relevant_count += important_information != 'NA'
+                continue
+            pending.discard(task)
+            i, bibtex_entry, metadata_text, source_complete = task.result()
+            bibtex_entries[i] = bibtex_entry
+            metadata_texts[i] = metadata_text
+            complete = complete and source_complete
+            if on_source:
+                on_source(i + 1, bibtex_entry, metadata_text)
+            # Optional preflight: filter papers in small batches as they arrive, overlapping with the slower fetches
+            if relevance_filter:
+                ready.append(i)
+
+        if not relevance_filter:
+            continue
+        # enough relevant papers already: stop fetching, but let batches already sent to the filter finish;
+        # cancelling a paper also cancels its downloads and extraction unless another caller awaits them
+        if relevant_count >= _RELEVANT_ENOUGH and pending:
+            for task in pending:
+                task.cancel()
+            for i in ready:
+                bibtex_entries[i] = None
+            pending, ready = set(), []
+        if ready and (len(ready) >= _FILTER_BATCH_SIZE or not pending):
+            batch_task = asyncio.create_task(async_retrieve_important_batch(user_output, [metadata_texts[j] for j in ready]))
+            filter_batches[batch_task] = ready
+            ready = []
+
+    # make bibtex_entries into dict form, leaving out entries that failed and so have no citation key
+    bibtex_dict = {key: bibtex_entry for bibtex_entry in bibtex_entries
+                   if bibtex_entry is not None and (key := extract_citation_key(bibtex_entry))}
+
+    # Pair each paper with its citation so the report can be written in one pass;
+    # the full bibtex stays in bibtex_dict, the prompt only needs the fields it cites with
+    sources = [{"id": i, "citation": slim_bibtex(bibtex_entry), "text": metadata_text[:_SOURCE_TEXT_LIMIT]}
+               for i, (bibtex_entry, metadata_text) in enumerate(zip(bibtex_entries, metadata_texts), start=1)
+               if bibtex_entry is not None and metadata_text != 'NA']
+
+    if complete:
+        cache.set(cache_key, (bibtex_dict, sources), expire=_CACHE_TTL)
+    return bibtex_dict, sources
+
+
+
+def generate_report_markdown(sources, user_output):
+    '''Stream the markdown report for user_output from sources, yielding text as it is written'''
+    # plain text rather than strict_json_async, since a JSON wrapper can't be rendered until it is complete
+    return cached_llm_stream(f'''Generate a research report in markdown format for the query: ```{user_output}```
 If format is specified, follow format strictly.
-You must do in-line citation with the [[1]], [[2]], [[3]] ... whenever possible.
-Link the citation url in the [[1]], [[2]], [[3]]
-Use as many sources as possible for each section of the report
-At the end of the report, list out all the sources using:
-`[source_number]: APA citation`
-
-Citation Details: ```{bibtex_dict}```''',
-            important_information,
-            output_format = {"Research Report": "Include citations, be as detailed as possible, type: str"},
-            llm = llm)
-
-    report = res["Research Report"]
-    return report
-
-
-def generate_pdf_from_markdown(markdown_text, bibtex_dict):
-    """Generates a PDF from Markdown text using ReportLab."""
-
-    doc = SimpleDocTemplate("report.pdf", pagesize=letter,
-                            rightMargin=72, leftMargin=72,
-                            topMargin=72, bottomMargin=18)
+Each source has an id, its citation (author, title, year, url) and its text.
+Use source i if and only if its text is relevant to the query, and cite it in-line with [[i]] whenever possible.
+Link the citation url in the [[i]]
+Use as many relevant sources as possible for each section of the report
+At the end of the report, list out all the sources used with:
+`[source_id]: APA citation`
+Include citations, be as detailed as possible.
+Output only the report in markdown.''',
+            str(sources))
+
+
+@st.cache_resource
+def get_pdf_styles():
+    """Builds the report stylesheet once and reuses it across PDF renders."""
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.enums import TA_JUSTIFY, TA_CENTER
     styles = getSampleStyleSheet()
     styles.add(ParagraphStyle(name='Justify', alignment=TA_JUSTIFY))
     styles.add(ParagraphStyle(name='Heading1',
@@ -202,6 +645,21 @@ def generate_pdf_from_markdown(markdown_text, bibtex_dict):
                           parent=styles['Normal'],
                           alignment=TA_CENTER,
                           ))
+    return styles
+
+
+def generate_pdf_from_markdown(markdown_text, bibtex_dict):
+    """Generates a PDF from Markdown text using ReportLab."""
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, PageBreak
+
+    # render in memory rather than round-tripping through report.pdf on disk
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter,
+                            rightMargin=72, leftMargin=72,
+                            topMargin=72, bottomMargin=18,
+                            pageCompression=1)
+    styles = get_pdf_styles()
 
     story = []
 
@@ -220,19 +678,64 @@ def generate_pdf_from_markdown(markdown_text, bibtex_dict):
             story.append(PageBreak())
         else:
              # Replace Markdown links with ReportLab's <link> tag
-            paragraph = re.sub(r'\[\[(.*?)\]\]\((.*?)\)', r'<link href="\2">\1</link>', paragraph)
+            paragraph = _CITATION_LINK_RE.sub(r'<link href="\2">\1</link>', paragraph)
             story.append(Paragraph(paragraph, styles['Justify']))
         story.append(Spacer(1, 12))
 
     doc.build(story)
-    with open("report.pdf", "rb") as f:
-        pdf_data = f.read()
-    return pdf_data
+    return buffer.getvalue()
 
 
 
 # --- Streamlit App ---
 
+class SessionResources:
+    '''A browser session's event loop, the async clients bound to it and its concurrency limits'''
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.clients = {}
+        # kept here rather than as module globals, which every rerun would recreate unbounded
+        self.pdf_sem = asyncio.Semaphore(_PDF_CONCURRENCY)
+        self.html_sem = asyncio.Semaphore(_HTML_CONCURRENCY)
+        self.http_sem = asyncio.Semaphore(_HTTP_CONCURRENCY)
+        self.llm_sem = asyncio.Semaphore(_LLM_CONCURRENCY)
+        # close everything once Streamlit drops the session's state, instead of pinning it until exit
+        weakref.finalize(self, close_session_resources, self.loop, self.clients)
+
+def close_session_resources(loop, clients):
+    '''Close a dropped session's clients on their own loop, then the loop itself'''
+    async def async_close_clients():
+        await asyncio.gather(*[client.close() for client in clients.values()], return_exceptions=True)
+
+    def close():
+        if loop.is_closed() or loop.is_running():
+            return
+        loop.run_until_complete(async_close_clients())
+        loop.close()
+    # on a fresh thread, since the garbage collector may run this inside another running loop
+    thread = threading.Thread(target=close)
+    thread.start()
+    thread.join()
+
+def get_session_resources():
+    if "session_resources" not in st.session_state:
+        st.session_state.session_resources = SessionResources()
+    return st.session_state.session_resources
+
+def get_event_loop():
+    '''Event loop kept per session, since the pooled HTTP session is bound to the loop that created it'''
+    return get_session_resources().loop
+
+def get_http_session():
+    '''Keep-alive aiohttp session reused across reruns, so arXiv connections are not re-established per click'''
+    clients = get_session_resources().clients
+    if "http" not in clients:
+        connector = aiohttp.TCPConnector(limit=64, limit_per_host=16, ttl_dns_cache=300, keepalive_timeout=60,
+                                         enable_cleanup_closed=True)
+        # ask for compressed bodies; brotli decoding comes from aiohttp[speedups]
+        clients["http"] = aiohttp.ClientSession(connector=connector, headers={"Accept-Encoding": "gzip, br"})
+    return clients["http"]
+
 async def main():  # Make main async
     st.title("Deep Research arXiv Paper Summarizer")
 
@@ -249,6 +752,12 @@ async def main():  # Make main async
     llm_model_name = st.selectbox("Select the reasoning model LLM Model Name", available_reasoning_model_list)
     st.session_state.llm_model_name = llm_model_name
 
+    available_relevance_model_list = ["gpt-4o-mini", "gpt-4.1-mini", "gpt-4o"]
+    if "relevance_model_name" not in st.session_state:
+        st.session_state.relevance_model_name = available_relevance_model_list[0]
+    relevance_model_name = st.selectbox("Select the LLM Model Name for the relevance filter", available_relevance_model_list)
+    st.session_state.relevance_model_name = relevance_model_name
+
     # Input for arXiv Search Query
     user_query = st.text_input("Enter your search query for arXiv papers:", "memory adaptive neuroscience")
 
@@ -270,27 +779,42 @@ async def main():  # Make main async
         string_data = uploaded_file.read().decode("utf-8")
         user_output = string_data  # Override user_output with file content
 
+    # Writing the report straight from the papers is faster; the preflight trades latency for fewer hallucinations
+    relevance_filter = st.checkbox("Filter papers for relevance before writing the report (slower)", value=False)
 
     if st.button("Generate Report"):
         if not st.session_state.openai_api_key:
             st.warning("Please enter your OpenAI API Key.")
             return
 
-        with st.spinner("Searching arXiv and generating report..."):
-            try:
-                async with aiohttp.ClientSession() as session:
-                    bibtex_dict, important_information = await search_arxiv(user_query, user_output, session)
-                    report_md = await generate_report_markdown(bibtex_dict, important_information, user_output)
+        def on_source(source_id, bibtex_entry, metadata_text):
+            # surface each paper as soon as it is ready instead of after the whole search
+            name = extract_citation_key(bibtex_entry) or f"paper {source_id}"
+            status.write(f"[{source_id}] {name}")
+
+        try:
+            # the status container is marked as errored if anything inside it raises
+            with st.status("Searching arXiv and generating report...", expanded=True) as status:
+                session = get_http_session()
+                bibtex_dict, sources = await search_arxiv(user_query, user_output, session, relevance_filter, on_source)
+                status.update(label="Papers retrieved, writing report...", state="complete", expanded=False)
+
+            # Display Markdown as it streams in rather than after the full completion
+            report_placeholder = st.empty()
+            report_md = ""
+            async for delta in generate_report_markdown(sources, user_output):
+                report_md += delta
+                report_placeholder.markdown(report_md)
 
-                st.markdown(report_md)  # Display Markdown
-                pdf_data = generate_pdf_from_markdown(report_md, bibtex_dict)
-                st.download_button("Download PDF", pdf_data, file_name="report.pdf", mime="application/pdf")
+            # ReportLab rendering is CPU-bound, so keep it off the event loop
+            pdf_data = await asyncio.to_thread(generate_pdf_from_markdown, report_md, bibtex_dict)
+            st.download_button("Download PDF", pdf_data, file_name="report.pdf", mime="application/pdf")
 
 
-            except Exception as e:
-                st.error(f"An error occurred: {e}")
+        except Exception as e:
+            st.error(f"An error occurred: {e}")
 
 
 # Run the app
 if __name__ == "__main__":
-    asyncio.run(main()) # Run the main function using asyncio.run
\ No newline at end of file
+    get_event_loop().run_until_complete(main()) # Reuse the session's loop so pooled connections stay valid
\ No newline at end of file